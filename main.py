@@ -1,11 +1,17 @@
 import os
+import sys
 import asyncio
-import json
 import logging
+import random
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from pathlib import Path
 import aiohttp
-import aiofiles
+import orjson
 from discord.ext import commands, tasks
 import tweepy
+from tweepy.asynchronous import AsyncStreamingClient
 import discord
 from dotenv import load_dotenv
 
@@ -17,15 +23,17 @@ logging.basicConfig(
 )
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-DISCORD_CHANNEL_ID = int(os.getenv("DISCORD_CHANNEL_ID"))
+DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 TWITTER_BEARER_TOKEN = os.getenv("TWITTER_BEARER_TOKEN")
 TWITTER_USERNAME = os.getenv("TWITTER_USERNAME")
 API_KEY = os.getenv("API_KEY")
 DOBBY_MODEL = os.getenv("DOBBY_MODEL", "accounts/fireworks/models/llama-v3p1-8b-instruct")
-CHECK_INTERVAL_SECONDS = int(os.getenv("CHECK_INTERVAL", 300))
 
-STATE_FILE = "tweet_tracker_state.json"
+STATE_FILE = Path("tweet_tracker_state.json")
 FIREWORKS_API_URL = "https://api.fireworks.ai/inference/v1/chat/completions"
+TWITTER_API_BASE = "https://api.twitter.com/2"
+TWEET_FIELDS = ["created_at", "text", "id", "in_reply_to_user_id"]
+SUMMARY_CACHE_SIZE = 256
 
 class TwitterBot(commands.Bot):
     def __init__(self):
@@ -33,162 +41,389 @@ class TwitterBot(commands.Bot):
         self.http_session = None
 
     async def setup_hook(self):
-        self.http_session = aiohttp.ClientSession()
+        connector = aiohttp.TCPConnector(
+            limit=50,
+            limit_per_host=10,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+        )
+        timeout = aiohttp.ClientTimeout(total=30, connect=10)
+        self.http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
         await self.add_cog(TwitterCog(self))
 
+    async def close(self):
+        if self.http_session and not self.http_session.closed:
+            await self.http_session.close()
+        await super().close()
+
     async def on_ready(self):
         logging.info(f"✅ Logged in as {self.user}")
 
+class TweetStream(AsyncStreamingClient):
+    def __init__(self, cog: "TwitterCog"):
+        super().__init__(TWITTER_BEARER_TOKEN)
+        self.cog = cog
+
+    async def on_tweet(self, tweet):
+        await self.cog._handle_tweet(tweet)
+
 class TwitterCog(commands.Cog):
     def __init__(self, bot: TwitterBot):
         self.bot = bot
-        self.twitter_client = tweepy.Client(bearer_token=TWITTER_BEARER_TOKEN)
+        self._webhook = discord.Webhook.from_url(DISCORD_WEBHOOK_URL, session=bot.http_session)
         self.twitter_user_id = None
         self.last_tweet_id = None
+        self.stream = TweetStream(self)
+        self._stream_task = None
+        self._dirty = False
+        self._check_lock = asyncio.Lock()
+        self._tweet_url_prefix = "https://twitter.com/" + TWITTER_USERNAME + "/status/"
+        self._embed_template = {
+            "color": discord.Color.blue().value,
+            "author": {
+                "name": f"New Tweet from @{TWITTER_USERNAME}",
+                "icon_url": "https://abs.twimg.com/icons/apple-touch-icon-192x192.png",
+            },
+            "footer": {"text": "Powered by Sentient & Dobby"},
+        }
+        self._fireworks_headers = {
+            "Authorization": f"Bearer {API_KEY}",
+            "Content-Type": "application/json",
+        }
+        self._fireworks_payload_base = {"model": DOBBY_MODEL, "temperature": 0.6}
+        self._prompt_prefix = "Summarize this tweet in one witty, bolded sentence and format it:\n\n"
+        self._summary_cache = OrderedDict()
+        self._rl_remaining = None
+        self._rl_reset = 0
+        self._c = 1.0
+        self._c_min = 1
+        self._c_max = 8
 
     async def cog_load(self):
         max_retries = 4
         for attempt in range(max_retries):
-            self.twitter_user_id = await self._get_twitter_user_id()
+            try:
+                self.twitter_user_id = await self._get_twitter_user_id()
+            except aiohttp.ClientResponseError as e:
+                logging.error(f"🚨 Twitter rejected our credentials ({e.status}). Retrying will not help; check TWITTER_BEARER_TOKEN.")
+                break
             if self.twitter_user_id:
                 self.last_tweet_id = await self._load_last_tweet_id()
                 logging.info(f"📌 Watching @{TWITTER_USERNAME} for new tweets. Last seen ID: {self.last_tweet_id}")
-                self.check_tweets.start()
+                await self._ensure_stream_rule()
+                self._stream_task = asyncio.create_task(self._run_stream())
+                self._flush_state.start()
+                try:
+                    await self._check_missed_tweets()
+                except Exception as e:
+                    logging.error(f"Startup catch-up failed: {e}")
                 return
 
-            wait_time = 2 ** attempt * 60
-            logging.warning(f"Attempt {attempt + 1}/{max_retries} failed to get Twitter user ID. Retrying in {wait_time // 60} minute(s)...")
+            wait_time = min(900, 2 ** attempt * 60) * random.uniform(0.5, 1.5)
+            logging.warning(f"Attempt {attempt + 1}/{max_retries} failed to get Twitter user ID. Retrying in {wait_time:.0f} second(s)...")
             await asyncio.sleep(wait_time)
 
         logging.error(f"🚨 Halting operations: Could not find Twitter user ID for {TWITTER_USERNAME} after {max_retries} attempts.")
-        if self.bot.http_session and not self.bot.http_session.closed:
-            await self.bot.http_session.close()
         await self.bot.close()
 
     async def cog_unload(self):
-        await self.bot.http_session.close()
-        self.check_tweets.cancel()
+        if self._stream_task:
+            self._stream_task.cancel()
+        self.stream.disconnect()
+        self._flush_state.cancel()
+        await self._flush_state()
+
+    async def _twitter_get(self, path: str, params: dict = None, retry: bool = True):
+        headers = {"Authorization": f"Bearer {TWITTER_BEARER_TOKEN}"}
+        async with self.bot.http_session.get(
+            f"{TWITTER_API_BASE}/{path}", params=params, headers=headers
+        ) as response:
+            remaining = response.headers.get("x-rate-limit-remaining")
+            reset = response.headers.get("x-rate-limit-reset")
+            if remaining is not None:
+                self._rl_remaining = int(remaining)
+            if reset is not None:
+                self._rl_reset = int(reset)
+            if response.status != 429:
+                if response.status in (401, 403):
+                    logging.error(f"Twitter API auth error {response.status} on {path}: {await response.text()}")
+                    response.raise_for_status()
+                if response.status != 200:
+                    logging.error(f"Twitter API error {response.status} on {path}: {await response.text()}")
+                    return None
+                return orjson.loads(await response.read())
+            retry_after = response.headers.get("Retry-After")
+
+        if not retry:
+            logging.warning(f"Twitter rate limit still active on {path}. Giving up on this request.")
+            return None
+        wait_time = int(retry_after) if retry_after else max(0, self._rl_reset - time.time())
+        logging.warning(f"Twitter rate limit hit on {path}. Backing off for {wait_time:.0f}s.")
+        await asyncio.sleep(wait_time)
+        return await self._twitter_get(path, params, retry=False)
+
+    async def _wait_if_throttled(self):
+        if self._rl_remaining is None or self._rl_remaining > 2:
+            return
+        wait_time = max(0, self._rl_reset - time.time())
+        if wait_time:
+            logging.warning(f"Only {self._rl_remaining} Twitter requests left this window. Waiting {wait_time:.0f}s for reset.")
+            await asyncio.sleep(wait_time)
 
     async def _get_twitter_user_id(self):
         try:
-            user_resp = await self.bot.loop.run_in_executor(
-                None, lambda: self.twitter_client.get_user(username=TWITTER_USERNAME)
-            )
-            if user_resp.data:
-                return user_resp.data.id
-        except Exception as e:
+            data = await self._twitter_get(f"users/by/username/{TWITTER_USERNAME}")
+            if data and data.get("data"):
+                return int(data["data"]["id"])
+        except aiohttp.ClientResponseError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error(f"Failed to fetch Twitter user ID: {e}")
         return None
 
+    async def _ensure_stream_rule(self):
+        rule_value = f"from:{TWITTER_USERNAME} -is:retweet -is:reply"
+        existing = await self.stream.get_rules()
+        if existing.data and any(rule.value == rule_value for rule in existing.data):
+            return
+        await self.stream.add_rules(tweepy.StreamRule(rule_value))
+
+    async def _run_stream(self):
+        attempt = 0
+        while not self.bot.is_closed():
+            stream_task = self.stream.filter(tweet_fields=TWEET_FIELDS)
+            connected_at = time.monotonic()
+            try:
+                await stream_task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Tweet stream disconnected: {e}")
+            if time.monotonic() - connected_at > 60:
+                attempt = 0
+            wait_time = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt = min(attempt + 1, 5)
+            logging.warning(f"Reconnecting tweet stream in {wait_time:.1f}s...")
+            await asyncio.sleep(wait_time)
+            try:
+                await self._check_missed_tweets()
+            except Exception as e:
+                logging.error(f"Catch-up after reconnect failed: {e}")
+
     async def _load_last_tweet_id(self):
-        if not os.path.exists(STATE_FILE):
+        if not STATE_FILE.exists():
             return None
         try:
-            async with aiofiles.open(STATE_FILE, "r") as f:
-                content = await f.read()
-                data = json.loads(content)
-                return data.get("last_tweet_id")
-        except (json.JSONDecodeError, IOError) as e:
+            content = await asyncio.to_thread(STATE_FILE.read_bytes)
+            data = orjson.loads(content)
+            return data.get("last_tweet_id")
+        except (orjson.JSONDecodeError, OSError) as e:
             logging.error(f"Error loading state from {STATE_FILE}: {e}")
             return None
 
-    async def _save_last_tweet_id(self, tweet_id: int):
+    def _save_last_tweet_id(self, tweet_id: int):
+        self.last_tweet_id = tweet_id
+        self._dirty = True
+
+    @tasks.loop(seconds=60)
+    async def _flush_state(self):
+        if not self._dirty:
+            return
+        tweet_id = self.last_tweet_id
+        tmp_file = STATE_FILE.with_suffix(".json.tmp")
         try:
-            async with aiofiles.open(STATE_FILE, "w") as f:
-                await f.write(json.dumps({"last_tweet_id": tweet_id}))
-            self.last_tweet_id = tweet_id
-        except IOError as e:
+            await asyncio.to_thread(tmp_file.write_bytes, orjson.dumps({"last_tweet_id": tweet_id}))
+            os.replace(tmp_file, STATE_FILE)
+            if self.last_tweet_id == tweet_id:
+                self._dirty = False
+        except OSError as e:
             logging.error(f"Error saving state to {STATE_FILE}: {e}")
 
-    async def _summarize_tweet(self, text: str):
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json",
-        }
+    async def _post_chat(self, content: str, max_tokens: int, response_format: dict = None):
         payload = {
-            "model": DOBBY_MODEL,
+            **self._fireworks_payload_base,
             "messages": [
-                {"role": "user", "content": f"Summarize this tweet in one witty, bolded sentence and format it:\n\n{text}"}
+                {"role": "user", "content": content}
             ],
-            "max_tokens": 80,
-            "temperature": 0.6,
+            "max_tokens": max_tokens,
         }
+        if response_format:
+            payload["response_format"] = response_format
         try:
-            async with self.bot.http_session.post(FIREWORKS_API_URL, json=payload, headers=headers) as response:
+            async with self.bot.http_session.post(
+                FIREWORKS_API_URL, data=orjson.dumps(payload), headers=self._fireworks_headers
+            ) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    self._c = min(self._c_max, self._c + 0.5)
+                    data = orjson.loads(await response.read())
                     return data["choices"][0]["message"]["content"].strip()
                 else:
+                    if response.status == 429 or response.status >= 500:
+                        self._c = max(self._c_min, self._c * 0.5)
                     logging.error(f"Fireworks API error {response.status}: {await response.text()}")
                     return None
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._c = max(self._c_min, self._c * 0.5)
             logging.error(f"HTTP request to summarizer failed: {e}")
             return None
 
-    @tasks.loop(seconds=CHECK_INTERVAL_SECONDS)
-    async def check_tweets(self):
-        channel = self.bot.get_channel(DISCORD_CHANNEL_ID)
-        if not channel:
-            logging.warning("Discord channel not found. Skipping check.")
+    @staticmethod
+    def _cache_key(text: str):
+        return blake2b(text.encode(), digest_size=16).digest()
+
+    def _cache_get(self, key: bytes):
+        summary = self._summary_cache.get(key)
+        if summary is not None:
+            self._summary_cache.move_to_end(key)
+        return summary
+
+    def _cache_put(self, key: bytes, summary):
+        if summary is None:
             return
+        self._summary_cache[key] = summary
+        self._summary_cache.move_to_end(key)
+        while len(self._summary_cache) > SUMMARY_CACHE_SIZE:
+            self._summary_cache.popitem(last=False)
 
-        try:
-            tweets_resp = await self.bot.loop.run_in_executor(
-                None,
-                lambda: self.twitter_client.get_users_tweets(
-                    id=self.twitter_user_id,
-                    since_id=self.last_tweet_id,
-                    max_results=5,
-                    tweet_fields=["created_at", "text", "id", "in_reply_to_user_id"],
-                    exclude=["retweets"]
-                )
-            )
-            new_tweets = sorted(tweets_resp.data, key=lambda t: t.id) if tweets_resp.data else []
-        except tweepy.errors.TooManyRequests:
-            logging.warning("Twitter rate limit hit. Pausing for 15 minutes.")
-            self.check_tweets.change_interval(minutes=15)
-            await asyncio.sleep(1)
-            self.check_tweets.change_interval(seconds=CHECK_INTERVAL_SECONDS)
+    async def _summarize_tweet(self, text: str):
+        key = self._cache_key(text)
+        summary = self._cache_get(key)
+        if summary is not None:
+            return summary
+        summary = await self._post_chat(self._prompt_prefix + text, 80)
+        self._cache_put(key, summary)
+        return summary
+
+    async def _summarize_each(self, texts):
+        sem = asyncio.Semaphore(int(self._c))
+
+        async def _one(text):
+            async with sem:
+                return await self._summarize_tweet(text)
+
+        return await asyncio.gather(*(_one(text) for text in texts))
+
+    async def _summarize_batch(self, texts):
+        keys = [self._cache_key(text) for text in texts]
+        summaries = [self._cache_get(key) for key in keys]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if not missing:
+            return summaries
+
+        if len(missing) == 1:
+            index = missing[0]
+            summaries[index] = await self._summarize_tweet(texts[index])
+            return summaries
+
+        prompt = (
+            "Summarize each tweet below in one witty, bolded sentence and format it. "
+            "Respond with only a JSON array of strings, one summary per tweet, in the same order.\n\n"
+            + "\n".join(f"{n + 1}. {texts[i]}" for n, i in enumerate(missing))
+        )
+        raw = await self._post_chat(prompt, 80 * len(missing), response_format={"type": "json_object"})
+        batch = None
+        if raw is not None:
+            try:
+                batch = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                batch = None
+            if isinstance(batch, dict):
+                batch = next((v for v in batch.values() if isinstance(v, list)), None)
+            if isinstance(batch, list) and len(batch) == len(missing):
+                batch = [str(s).strip() for s in batch]
+            else:
+                logging.warning("Batch summary response did not line up with the tweets. Falling back to per-tweet summaries.")
+                batch = None
+        if batch is None:
+            batch = await self._summarize_each([texts[i] for i in missing])
+        for i, summary in zip(missing, batch):
+            self._cache_put(keys[i], summary)
+            summaries[i] = summary
+        return summaries
+
+    def _should_post(self, tweet):
+        if tweet.in_reply_to_user_id is not None:
+            logging.info(f"Skipping tweet {tweet.id} as it is a reply.")
+            return False
+        if self.last_tweet_id and tweet.id <= self.last_tweet_id:
+            logging.info(f"Skipping tweet {tweet.id} as it was already posted.")
+            return False
+        return True
+
+    def _build_embed(self, tweet, summary, tweet_url):
+        data = dict(self._embed_template)
+        data["description"] = summary or tweet.text
+        data["author"] = {**data["author"], "url": tweet_url}
+        return discord.Embed.from_dict(data)
+
+    async def _post_tweets(self, tweets, summaries):
+        tweet_urls = [self._tweet_url_prefix + str(tweet.id) for tweet in tweets]
+        embeds = [
+            self._build_embed(tweet, summary, tweet_url)
+            for tweet, summary, tweet_url in zip(tweets, summaries, tweet_urls)
+        ]
+        content = "@everyone " + "\n".join(tweet_urls)
+        await self._webhook.send(content=content, embeds=embeds[:10])
+        self._save_last_tweet_id(tweets[-1].id)
+
+    async def _handle_tweet(self, tweet):
+        async with self._check_lock:
+            if not self._should_post(tweet):
+                return
+            summary = await self._summarize_tweet(tweet.text)
+            await self._post_tweets([tweet], [summary])
+
+    async def _check_missed_tweets(self):
+        if self._check_lock.locked():
+            logging.info("Previous tweet check still running; skipping this one.")
             return
-        except Exception as e:
+        async with self._check_lock:
+            await self._do_check_missed_tweets()
+
+    async def _do_check_missed_tweets(self):
+        await self._wait_if_throttled()
+        params = {
+            "max_results": "5",
+            "tweet.fields": ",".join(TWEET_FIELDS),
+            "exclude": "retweets",
+        }
+        if self.last_tweet_id:
+            params["since_id"] = str(self.last_tweet_id)
+
+        try:
+            data = await self._twitter_get(f"users/{self.twitter_user_id}/tweets", params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error(f"An unexpected error occurred fetching tweets: {e}")
             return
+        if data is None:
+            return
 
-        if not new_tweets:
-            logging.info("No new tweets found.")
+        if not data.get("meta", {}).get("result_count"):
+            logging.info("No missed tweets found.")
             return
 
-        logging.info(f"Found {len(new_tweets)} new tweet(s).")
-        for tweet in new_tweets:
-            if tweet.in_reply_to_user_id is not None:
-                logging.info(f"Skipping tweet {tweet.id} as it is a reply.")
-                continue 
+        new_tweets = sorted((tweepy.Tweet(t) for t in data.get("data", [])), key=lambda t: t.id)
+        new_tweets = [tweet for tweet in new_tweets if self._should_post(tweet)]
 
-            summary = await self._summarize_tweet(tweet.text)
-            
-            embed = discord.Embed(
-                description=summary or tweet.text,
-                color=discord.Color.blue()
-            )
-            
-            tweet_url = f"https://twitter.com/{TWITTER_USERNAME}/status/{tweet.id}"
-
-            embed.set_author(
-                name=f"New Tweet from @{TWITTER_USERNAME}",
-                url=tweet_url,
-                icon_url="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
-            )
-            embed.set_footer(text="Powered by Sentient & Dobby")
-            
-            await channel.send(embed=embed)
-            await channel.send(f"@everyone {tweet_url}")
-
-            await self._save_last_tweet_id(tweet.id)
-            await asyncio.sleep(1)
+        if not new_tweets:
+            logging.info("No missed tweets found.")
+            return
+
+        logging.info(f"Found {len(new_tweets)} missed tweet(s).")
+        summaries = await self._summarize_batch([tweet.text for tweet in new_tweets])
+        await self._post_tweets(new_tweets, summaries)
 
 if __name__ == "__main__":
-    if not all([DISCORD_TOKEN, TWITTER_BEARER_TOKEN, API_KEY, TWITTER_USERNAME]):
+    if not all([DISCORD_TOKEN, DISCORD_WEBHOOK_URL, TWITTER_BEARER_TOKEN, API_KEY, TWITTER_USERNAME]):
         logging.critical("🚨 Missing one or more critical environment variables. Exiting.")
     else:
+        if sys.platform != "win32":
+            try:
+                import uvloop
+            except ImportError:
+                logging.info("uvloop not installed; using the default asyncio event loop.")
+            else:
+                uvloop.install()
         bot = TwitterBot()
-        bot.run(DISCORD_TOKEN)
\ No newline at end of file
+        bot.run(DISCORD_TOKEN)